@@ -4,8 +4,31 @@ This module provides functions to process markdown files and convert Mermaid dia
 
 import os
 import re
+import shutil
 import logging
-from mermaidpix.mermaid_converter import convert_mermaid_to_png
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, Optional
+from mermaidpix.mermaid_converter import (
+    check_mermaid_cli,
+    convert_mermaid_batch,
+    get_deterministic_filename,
+    get_max_parallel_renders,
+)
+
+logger = logging.getLogger(__name__)
+
+# Regex pattern to find Mermaid code blocks. The body may not contain a triple
+# backtick, so each attempt stops at the next fence instead of backtracking over
+# the rest of the document. Both fences must sit on their own lines; the start of
+# line check is a lookbehind after the literal so the engine can still jump
+# straight to each '```mermaid' occurrence. A UTF-8 byte order mark at the start
+# of the document counts as a line start.
+_MERMAID_RE = re.compile(
+    rb"```mermaid(?:(?<![^\n]```mermaid)|(?<=\A\xef\xbb\xbf```mermaid))"
+    rb"\r?\n((?:[^`]|`(?!``))*?)\r?\n```[ \t]*(?![^\r\n])"
+)
 
 
 def validate_input_file(input_file: str) -> None:
@@ -30,6 +53,44 @@ def ensure_image_directory(image_dir: str) -> None:
     os.makedirs(image_dir, exist_ok=True)
 
 
+def write_output_file(output_file: str, chunks: Iterable[bytes]) -> None:
+    """Write the output file atomically.
+
+    The chunks go to a uniquely named temporary file next to the output, which is
+    renamed over it once complete, so an interrupted run never leaves a truncated
+    document behind. Links are resolved first so the rename replaces their target,
+    not the link itself, and an existing output keeps its permissions.
+
+    Args:
+        output_file (str): The path to save the processed output.
+        chunks (Iterable[bytes]): The pieces of the document, in order.
+    """
+    target_file = os.path.realpath(output_file)
+    target_dir, target_name = os.path.split(target_file)
+    fd, temp_output_file = tempfile.mkstemp(
+        prefix=f".{target_name}.", suffix=".tmp", dir=target_dir
+    )
+    try:
+        with os.fdopen(fd, "wb", buffering=1 << 20) as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(target_file):
+            shutil.copymode(target_file, temp_output_file)
+        else:
+            # mkstemp creates the file as 0600; give a new output the mode open()
+            # would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_output_file, 0o666 & ~umask)
+        os.replace(temp_output_file, target_file)
+    except BaseException:
+        if os.path.exists(temp_output_file):
+            os.remove(temp_output_file)
+        raise
+
+
 def process_markdown_file(input_file: str, output_file: str, *, image_dir: str) -> None:
     """Process a markdown file and save the output to a specified file.
 
@@ -42,7 +103,7 @@ def process_markdown_file(input_file: str, output_file: str, *, image_dir: str)
     if os.path.exists(output_file):
         overwrite = input(f"The file '{output_file}' already exists. Overwrite? (y/n): ")
         if overwrite.lower() != 'y':
-            logging.info("Operation cancelled by the user.")
+            logger.info("Operation cancelled by the user.")
             return
 
     # Resolve and expand user paths
@@ -51,40 +112,117 @@ def process_markdown_file(input_file: str, output_file: str, *, image_dir: str)
     image_dir = os.path.relpath(os.path.expanduser(image_dir))
 
     validate_input_file(input_file)
-    ensure_image_directory(image_dir)
 
-    with open(input_file, "r", encoding="utf-8") as f:
+    # The document is handled as UTF-8 bytes: only the image links are encoded,
+    # and the diagram sources go to the hash and to mmdc without a decode
+    with open(input_file, "rb") as f:
         content = f.read()
 
+    # Nothing to convert: write the document as is and skip the regex scan
+    if b"```mermaid" not in content:
+        logger.info("No Mermaid diagrams found in '%s'.", input_file)
+        if os.path.exists(output_file) and os.path.samefile(input_file, output_file):
+            return  # Processing in place: the output is already up to date
+        write_output_file(output_file, [content])
+        return
+
     ensure_image_directory(image_dir)
 
-    def replace_mermaid(match: re.Match) -> str:
-        """Replace Mermaid code blocks with corresponding PNG images.
+    # Image links are relative to the output file and share the same directory
+    image_link_dir = os.path.relpath(image_dir, os.path.dirname(output_file))
+    image_link_prefix = (
+        "" if image_link_dir == os.curdir else os.path.join(image_link_dir, "")
+    )
+
+    def replace_mermaid(match: re.Match, image_filename: Optional[str]) -> bytes:
+        """Replace a Mermaid code block with its corresponding PNG image.
 
         Args:
             match (re.Match): The regex match object containing the Mermaid code.
+            image_filename (Optional[str]): The converted image filename, or None if
+                conversion failed.
 
         Returns:
-            str: Markdown string with the image link or original Mermaid code if conversion fails.
+            bytes: Markdown with the image link, or the original block if conversion
+                failed.
         """
-        mermaid_code = match.group(1)
-        logging.debug("Processing Mermaid diagram:\n%s", mermaid_code)
-
-        image_filename = convert_mermaid_to_png(mermaid_code, image_dir)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Processing Mermaid diagram:\n%s",
+                match.group(1).decode("utf-8", "replace"),
+            )
 
         if image_filename:
-            return f"\n![Mermaid Diagram]({os.path.relpath(os.path.join(image_dir, image_filename), os.path.dirname(output_file))})\n"
+            image_link = f"![Mermaid Diagram]({image_link_prefix}{image_filename})"
+            return line_ending + image_link.encode("utf-8") + line_ending
         else:
-            logging.warning(
+            logger.warning(
                 "Failed to convert Mermaid diagram to PNG. Keeping original Mermaid code."
             )
             return match.group(0)
 
-    # Regex pattern to find Mermaid code blocks
-    pattern = r"```mermaid\n(.*?)\n```"
-
-    # Replace Mermaid code blocks with their corresponding PNG images
-    new_content = re.sub(pattern, replace_mermaid, content, flags=re.DOTALL)
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(new_content)
+    # Only the block positions are kept; the text between blocks is sliced out
+    # while writing instead of being copied up front
+    matches = list(_MERMAID_RE.finditer(content))
+    # Diagram sources use '\n' line endings whatever the document uses, so a
+    # CRLF copy of a document maps to the same images. The links follow the
+    # document's own line ending.
+    mermaid_codes = [match.group(1).replace(b"\r\n", b"\n") for match in matches]
+    line_ending = b"\r\n" if b"\r\n" in content else b"\n"
+
+    # Diagrams rendered by an earlier run are resolved with one directory listing
+    # instead of a stat per diagram
+    existing_images = set(os.listdir(image_dir))
+    image_filenames: Dict[bytes, Optional[str]] = {}
+    pending_codes = []
+    for mermaid_code in dict.fromkeys(mermaid_codes):
+        image_filename = get_deterministic_filename(mermaid_code)
+        if image_filename in existing_images:
+            image_filenames[mermaid_code] = image_filename
+        else:
+            pending_codes.append(mermaid_code)
+
+    # Without mmdc the remaining blocks are kept as they are; report it once
+    # instead of failing every diagram separately
+    if pending_codes and not check_mermaid_cli():
+        logger.error(
+            "Mermaid CLI (mmdc) not found. "
+            "Install it with 'npm install -g @mermaid-js/mermaid-cli'."
+        )
+        image_filenames.update(dict.fromkeys(pending_codes))
+        pending_codes = []
+
+    # Each mmdc run is an independent subprocess, so the remaining diagrams are
+    # spread over concurrent batches. Batching pays the mmdc startup once per run
+    # instead of per diagram, but mmdc renders every block of a batch at once, so
+    # workers x batch size is kept within the renders the memory allows.
+    max_renders = get_max_parallel_renders()
+    max_workers = min(os.cpu_count() or 1, max_renders)
+    batch_size = max(
+        1, min(max_renders // max_workers, -(-len(pending_codes) // max_workers))
+    )
+    batches = [
+        pending_codes[i : i + batch_size]
+        for i in range(0, len(pending_codes), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_filenames in executor.map(
+            partial(convert_mermaid_batch, output_dir=image_dir), batches
+        ):
+            image_filenames.update(batch_filenames)
+
+    def output_chunks():
+        """Yield the document with each Mermaid block replaced.
+
+        Memoryview slices hand the text between blocks to the writer without
+        copying, and the document is never assembled in memory.
+        """
+        content_view = memoryview(content)
+        position = 0
+        for match, mermaid_code in zip(matches, mermaid_codes):
+            yield content_view[position : match.start()]
+            yield replace_mermaid(match, image_filenames[mermaid_code])
+            position = match.end()
+        yield content_view[position:]
+
+    write_output_file(output_file, output_chunks())
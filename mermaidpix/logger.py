@@ -4,17 +4,26 @@ This module provides functions to process markdown files and convert Mermaid dia
 
 import logging
 
+_SETUP_DONE = False
+
 
 def setup_logging(verbose: bool) -> None:
     """
     Set up logging configuration.
 
+    Handlers are only installed on the first call; later calls are no-ops.
+
     Args:
         verbose (bool): If True, set the logging level to DEBUG. If False, set it to INFO.
 
     Returns:
         None
     """
+    global _SETUP_DONE  # pylint: disable=global-statement
+    if _SETUP_DONE:
+        return
+    _SETUP_DONE = True
+
     level = logging.DEBUG if verbose else logging.INFO
 
     # Create a custom formatter with timestamp, level, and message
@@ -33,5 +42,3 @@ def setup_logging(verbose: bool) -> None:
     logger.setLevel(level)
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
-
-    logging.basicConfig(level=level, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -3,39 +3,158 @@ This module provides functions to process markdown files and convert Mermaid dia
 """
 
 import os
+import shutil
 import subprocess
 import hashlib
 import logging
+import tempfile
 import time
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 
+logger = logging.getLogger(__name__)
 
-def get_deterministic_filename(mermaid_code: str) -> str:
+# Rendering options passed to mmdc; they are part of the image cache key
+MMDC_RENDER_ARGS = (
+    "-b",
+    "transparent",
+    "-w",
+    "3840",
+    "-H",
+    "2160",  # 4K resolution
+    "-s",
+    "4",  # Scale factor
+)
+
+# Approximate memory used by one mmdc run (Node.js plus a headless Chromium)
+MMDC_MEMORY_ESTIMATE = 400 * 1024 * 1024
+
+# Diagrams rendered at once per CPU when the available memory cannot be read
+MMDC_FALLBACK_RENDERS_PER_CPU = 4
+
+
+@lru_cache(maxsize=None)
+def get_mmdc_path() -> Optional[str]:
+    """
+    Resolves the Mermaid CLI executable on the PATH.
+
+    The lookup is only performed once per process.
+
+    Returns:
+        Optional[str]: The absolute path to mmdc, or None if it is not installed.
+    """
+    return shutil.which("mmdc")
+
+
+def check_mermaid_cli() -> bool:
+    """
+    Checks whether the Mermaid CLI is installed.
+
+    Returns:
+        bool: True if mmdc was found on the PATH, False otherwise.
+    """
+    return get_mmdc_path() is not None
+
+
+def get_available_memory() -> Optional[int]:
+    """
+    Returns the memory available for new processes, as reported by /proc/meminfo.
+
+    Returns:
+        Optional[int]: The available memory in bytes, or None where it is unknown
+                       (e.g. on macOS and Windows).
+    """
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024  # Reported in kB
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_max_parallel_renders() -> int:
+    """
+    Returns how many Mermaid diagrams may be rendered at the same time.
+
+    Every diagram being rendered holds a headless Chromium (or a page of one in a
+    batched run), so the limit is the available memory divided by
+    MMDC_MEMORY_ESTIMATE. Where the available memory is unknown, each CPU is
+    allowed MMDC_FALLBACK_RENDERS_PER_CPU diagrams so that batching still applies.
+
+    Returns:
+        int: The maximum number of diagrams rendered at once, at least 1.
+    """
+    available = get_available_memory()
+    if available is None:
+        return (os.cpu_count() or 1) * MMDC_FALLBACK_RENDERS_PER_CPU
+    return max(1, available // MMDC_MEMORY_ESTIMATE)
+
+
+@lru_cache(maxsize=None)
+def get_mmdc_version() -> bytes:
+    """
+    Returns the version reported by the installed Mermaid CLI.
+
+    The lookup spawns mmdc, so it is only performed once per process.
+
+    Returns:
+        bytes: The output of 'mmdc --version', or an empty string if it cannot be run.
+    """
+    mmdc = get_mmdc_path()
+    if mmdc is None:
+        return b""
+
+    try:
+        result = subprocess.run(
+            [mmdc, "--version"], capture_output=True, timeout=60, check=False
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return b""
+    return result.stdout.strip()
+
+
+@lru_cache(maxsize=None)
+def get_render_settings_key() -> bytes:
+    """
+    Returns the part of the image cache key that does not depend on the diagram.
+
+    Returns:
+        bytes: The mmdc version and rendering options, each prefixed with '|'.
+    """
+    return b"|" + get_mmdc_version() + b"|" + " ".join(MMDC_RENDER_ARGS).encode()
+
+
+@lru_cache(maxsize=4096)
+def get_deterministic_filename(mermaid_code: bytes) -> str:
     """
     Generates a deterministic filename for a given Mermaid code.
 
+    The hash covers the Mermaid code, the mmdc version and the rendering options,
+    so changing any of them produces a new image instead of reusing a stale one.
+
     Args:
-        mermaid_code (str): The Mermaid code for which the filename is generated.
+        mermaid_code (bytes): The UTF-8 encoded Mermaid code for which the filename
+                              is generated.
 
     Returns:
         str: The deterministic filename in the format 'mermaid_{hash}.png', where
-              'hash' is the first 16 characters of the MD5 hash of the Mermaid code.
+              'hash' is the 16 character BLAKE2b hash of the code and render settings.
     """
-    hash_object = hashlib.md5(mermaid_code.encode())
-    hash_hex = hash_object.hexdigest()
-    return f"mermaid_{hash_hex[:16]}.png"
+    # Hashing the two parts in turn avoids concatenating them into a new buffer
+    hash_object = hashlib.blake2b(mermaid_code, digest_size=8)
+    hash_object.update(get_render_settings_key())
+    return f"mermaid_{hash_object.hexdigest()}.png"
 
 
-def convert_mermaid_to_png(
-    mermaid_code: str, output_dir: str, dpi: int = 300
-) -> Optional[str]:
+def convert_mermaid_to_png(mermaid_code: bytes, output_dir: str) -> Optional[str]:
     """
     Converts a Mermaid diagram code to a PNG image.
 
     Args:
-        mermaid_code (str): The Mermaid diagram code to convert.
+        mermaid_code (bytes): The UTF-8 encoded Mermaid diagram code to convert.
         output_dir (str): The directory where the PNG image will be saved.
-        dpi (int, optional): The DPI (dots per inch) of the output image. Defaults to 300.
 
     Returns:
         Optional[str]: The filename of the converted PNG image if successful, None otherwise.
@@ -43,60 +162,174 @@ def convert_mermaid_to_png(
     filename = get_deterministic_filename(mermaid_code)
     output_path = os.path.join(output_dir, filename)
 
-    temp_file = f"temp_{hashlib.md5(mermaid_code.encode()).hexdigest()[:8]}.mmd"
+    if os.path.exists(output_path):
+        logger.debug("Reusing existing PNG for Mermaid diagram: %s", output_path)
+        return filename
 
-    with open(temp_file, "w", encoding="utf-8") as f:  # Specify encoding
-        f.write(mermaid_code)
+    mmdc = get_mmdc_path()
+    if mmdc is None:
+        logger.error("Mermaid CLI (mmdc) not found on PATH")
+        return None
 
-    logging.debug("Converting Mermaid diagram to PNG: %s -> %s", temp_file, output_path)
+    logger.debug("Converting Mermaid diagram to PNG: %s", output_path)
 
     try:
         start_time = time.time()
-        process = subprocess.Popen(
+        # mmdc reads the diagram from stdin when the input is "-"
+        result = subprocess.run(
             [
-                "mmdc",
+                mmdc,
                 "-i",
-                temp_file,
+                "-",
                 "-o",
                 output_path,
-                "-b",
-                "transparent",
-                "-w",
-                "3840",
-                "-H",
-                "2160",  # 4K resolution
-                "-s",
-                "4",
-            ],  # Scale factor
-            stdout=subprocess.PIPE,
+                *MMDC_RENDER_ARGS,
+            ],
+            input=mermaid_code,
+            stdout=subprocess.DEVNULL,  # Only Puppeteer progress noise
             stderr=subprocess.PIPE,
-            text=True,
+            timeout=60,  # 60 seconds timeout
+            check=False,
         )
 
-        stdout, stderr = process.communicate(timeout=60)  # 60 seconds timeout
-        logging.info(
-            "Process output: %s", stdout
-        )  # Log the stdout using lazy formatting
-
-        if process.returncode != 0:
-            logging.error("Error converting Mermaid to PNG: %s", stderr)
+        if result.returncode != 0:
+            logger.error(
+                "Error converting Mermaid to PNG: %s",
+                result.stderr.decode("utf-8", "replace"),
+            )
             return None
 
         end_time = time.time()
-        logging.debug("Conversion completed in %.2f seconds", end_time - start_time)
+        logger.debug("Conversion completed in %.2f seconds", end_time - start_time)
 
     except subprocess.TimeoutExpired:
-        logging.error("Mermaid conversion timed out after 60 seconds")
-        process.kill()
+        logger.error("Mermaid conversion timed out after 60 seconds")
         return None
 
     # pylint: disable=broad-exception-caught
     except Exception as e:
-        logging.error("Unexpected error during Mermaid conversion: %s", str(e))
+        logger.error("Unexpected error during Mermaid conversion: %s", str(e))
         return None
 
-    finally:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-
     return filename
+
+
+def _render_batch(mermaid_codes: List[bytes], output_dir: str, mmdc: str) -> List[str]:
+    """
+    Renders several Mermaid diagrams with a single mmdc run.
+
+    The diagrams are written as fenced blocks to a temporary markdown file; mmdc
+    renders every block in one browser session and numbers the images after the
+    output template ('diagram-1.png', 'diagram-2.png', ...).
+
+    Args:
+        mermaid_codes (List[bytes]): The UTF-8 encoded Mermaid diagram codes.
+        output_dir (str): The directory where the PNG images will be saved.
+        mmdc (str): The path to the Mermaid CLI executable.
+
+    Returns:
+        List[str]: The filenames of the converted PNG images, in the order of
+                   'mermaid_codes', or an empty list if the batch failed.
+    """
+    # The temporary directory lives in output_dir so the images can be renamed
+    # into place atomically
+    with tempfile.TemporaryDirectory(prefix=".mermaidpix_", dir=output_dir) as temp_dir:
+        markdown_path = os.path.join(temp_dir, "diagrams.md")
+        with open(markdown_path, "wb") as f:
+            f.write(
+                b"\n\n".join(
+                    b"```mermaid\n" + code + b"\n```" for code in mermaid_codes
+                )
+            )
+
+        logger.debug("Converting %d Mermaid diagrams in one batch", len(mermaid_codes))
+
+        try:
+            start_time = time.time()
+            result = subprocess.run(
+                [
+                    mmdc,
+                    "-i",
+                    markdown_path,
+                    "-o",
+                    os.path.join(temp_dir, "diagram.png"),
+                    *MMDC_RENDER_ARGS,
+                ],
+                stdout=subprocess.DEVNULL,  # Only Puppeteer progress noise
+                stderr=subprocess.PIPE,
+                timeout=60 * len(mermaid_codes),  # 60 seconds per diagram
+                check=False,
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning("Mermaid batch conversion timed out")
+            return []
+
+        if result.returncode != 0:
+            logger.warning(
+                "Error converting Mermaid batch to PNG: %s",
+                result.stderr.decode("utf-8", "replace"),
+            )
+            return []
+
+        image_paths = [
+            os.path.join(temp_dir, f"diagram-{i}.png")
+            for i in range(1, len(mermaid_codes) + 1)
+        ]
+        extra_image = os.path.join(temp_dir, f"diagram-{len(mermaid_codes) + 1}.png")
+        if not all(map(os.path.exists, image_paths)) or os.path.exists(extra_image):
+            logger.warning("Mermaid batch produced unexpected images")
+            return []
+
+        filenames = []
+        for mermaid_code, image_path in zip(mermaid_codes, image_paths):
+            filename = get_deterministic_filename(mermaid_code)
+            os.replace(image_path, os.path.join(output_dir, filename))
+            filenames.append(filename)
+
+        end_time = time.time()
+        logger.debug(
+            "Batch conversion completed in %.2f seconds", end_time - start_time
+        )
+
+    return filenames
+
+
+def convert_mermaid_batch(
+    mermaid_codes: List[bytes], output_dir: str
+) -> Dict[bytes, Optional[str]]:
+    """
+    Converts several Mermaid diagram codes to PNG images.
+
+    Starting mmdc (Node.js and a headless Chromium) dominates the cost of small
+    diagrams, so the diagrams are rendered together by one mmdc run. Any diagram
+    the batch could not render is converted on its own instead.
+
+    Args:
+        mermaid_codes (List[bytes]): The distinct UTF-8 encoded Mermaid diagram codes.
+        output_dir (str): The directory where the PNG images will be saved.
+
+    Returns:
+        Dict[bytes, Optional[str]]: The filename of the converted PNG image for each
+                                  Mermaid code, or None if its conversion failed.
+    """
+    image_filenames: Dict[bytes, Optional[str]] = {}
+
+    # mmdc also ends markdown fences on ':::', which Mermaid uses for class
+    # shorthand, so such diagrams cannot be embedded in the batch file
+    batch_codes = [code for code in mermaid_codes if b":::" not in code]
+    mmdc = get_mmdc_path()
+    if mmdc is not None and len(batch_codes) > 1:
+        try:
+            image_filenames.update(
+                zip(batch_codes, _render_batch(batch_codes, output_dir, mmdc))
+            )
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.warning("Unexpected error during Mermaid batch conversion: %s", e)
+
+    for mermaid_code in mermaid_codes:
+        if mermaid_code not in image_filenames:
+            image_filenames[mermaid_code] = convert_mermaid_to_png(
+                mermaid_code, output_dir
+            )
+    return image_filenames
@@ -0,0 +1,336 @@
+"""
+Tests for the Mermaid conversion pipeline, run against a stub mmdc on the PATH.
+"""
+
+import os
+import stat
+import sys
+import textwrap
+
+import pytest
+
+from mermaidpix import mermaid_converter
+from mermaidpix.file_processor import _MERMAID_RE, process_markdown_file
+from mermaidpix.mermaid_converter import (
+    convert_mermaid_batch,
+    get_deterministic_filename,
+)
+
+# Stand-in for mmdc: writes the diagram source as the "image" and logs each run.
+# Markdown input is rendered like mmdc does, to '<output>-<n>.<ext>' per block.
+STUB_MMDC = textwrap.dedent(
+    """\
+    import os
+    import re
+    import sys
+
+    args = sys.argv[1:]
+    if "--version" in args:
+        print("0.0.0-stub")
+        sys.exit(0)
+    source = args[args.index("-i") + 1]
+    output = args[args.index("-o") + 1]
+    mode = os.environ.get("STUB_MMDC_MODE", "")
+    with open(os.environ["STUB_MMDC_LOG"], "a", encoding="utf-8") as log:
+        if source == "-":
+            log.write("single\\n")
+            with open(output, "wb") as f:
+                f.write(sys.stdin.buffer.read())
+            sys.exit(0)
+        with open(source, "rb") as f:
+            pattern = rb"^```mermaid\\r?\\n(.*?)\\r?\\n```"
+            blocks = re.findall(pattern, f.read(), re.M | re.S)
+        log.write(f"batch {len(blocks)}\\n")
+    if mode == "fail_batch":
+        print("stub batch failure", file=sys.stderr)
+        sys.exit(1)
+    if mode == "extra_image":
+        blocks.append(b"unexpected")
+    base, ext = os.path.splitext(output)
+    for i, block in enumerate(blocks, 1):
+        with open(f"{base}-{i}{ext}", "wb") as f:
+            f.write(block)
+    """
+)
+
+
+def _clear_caches() -> None:
+    mermaid_converter.get_mmdc_path.cache_clear()
+    mermaid_converter.get_mmdc_version.cache_clear()
+    mermaid_converter.get_render_settings_key.cache_clear()
+    get_deterministic_filename.cache_clear()
+
+
+@pytest.fixture
+def stub_mmdc(tmp_path, monkeypatch):
+    """Put a stub mmdc first on the PATH and return the path of its run log."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "mmdc"
+    script.write_text(f"#!{sys.executable}\n{STUB_MMDC}", encoding="utf-8")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+    log_file = tmp_path / "mmdc.log"
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_MMDC_LOG", str(log_file))
+    _clear_caches()
+    yield log_file
+    _clear_caches()
+
+
+def _runs(log_file) -> list:
+    return log_file.read_text(encoding="utf-8").split("\n")[:-1]
+
+
+def _assert_rendered(output_dir, mermaid_codes, image_filenames) -> None:
+    for code in mermaid_codes:
+        filename = image_filenames[code]
+        assert filename == get_deterministic_filename(code)
+        assert (output_dir / filename).read_bytes() == code
+    assert sorted(os.listdir(output_dir)) == sorted(image_filenames.values())
+
+
+PLAIN_DOCUMENT = b"# No diagrams\r\n\r\nJust ```code``` and text.\n"
+
+
+CODES = [b"graph TD\n  A-->B", b"graph TD\n  C-->D", b"sequenceDiagram\n  A->>B: hi"]
+
+
+def test_batch_maps_numbered_images_to_deterministic_filenames(stub_mmdc, tmp_path):
+    output_dir = tmp_path / "images"
+    output_dir.mkdir()
+
+    image_filenames = convert_mermaid_batch(CODES, str(output_dir))
+
+    assert _runs(stub_mmdc) == ["batch 3"]
+    _assert_rendered(output_dir, CODES, image_filenames)
+
+
+def test_failed_batch_falls_back_to_single_conversions(
+    stub_mmdc, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("STUB_MMDC_MODE", "fail_batch")
+    output_dir = tmp_path / "images"
+    output_dir.mkdir()
+
+    image_filenames = convert_mermaid_batch(CODES, str(output_dir))
+
+    assert _runs(stub_mmdc) == ["batch 3", "single", "single", "single"]
+    _assert_rendered(output_dir, CODES, image_filenames)
+
+
+def test_unexpected_batch_images_fall_back_to_single_conversions(
+    stub_mmdc, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("STUB_MMDC_MODE", "extra_image")
+    output_dir = tmp_path / "images"
+    output_dir.mkdir()
+
+    image_filenames = convert_mermaid_batch(CODES, str(output_dir))
+
+    assert _runs(stub_mmdc) == ["batch 3", "single", "single", "single"]
+    _assert_rendered(output_dir, CODES, image_filenames)
+
+
+def test_class_shorthand_diagrams_skip_the_batch(stub_mmdc, tmp_path):
+    output_dir = tmp_path / "images"
+    output_dir.mkdir()
+    codes = CODES + [b"graph TD\n  A:::highlight"]
+
+    image_filenames = convert_mermaid_batch(codes, str(output_dir))
+
+    assert _runs(stub_mmdc) == ["batch 3", "single"]
+    _assert_rendered(output_dir, codes, image_filenames)
+
+
+def test_batches_stay_within_the_render_limit(stub_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    monkeypatch.setattr(
+        "mermaidpix.file_processor.get_max_parallel_renders", lambda: 4
+    )
+    codes = [f"graph TD\n  A-->N{i}" for i in range(10)]
+    input_file = tmp_path / "input.md"
+    input_file.write_text(
+        "\n\n".join(f"```mermaid\n{code}\n```" for code in codes), encoding="utf-8"
+    )
+
+    process_markdown_file(
+        str(input_file), str(tmp_path / "output.md"), image_dir=str(tmp_path / "img")
+    )
+
+    # Two workers sharing a budget of four renders: at most two diagrams per run
+    runs = _runs(stub_mmdc)
+    assert runs == ["batch 2"] * 5
+    output = (tmp_path / "output.md").read_text(encoding="utf-8")
+    for code in codes:
+        assert get_deterministic_filename(code.encode()) in output
+
+
+def test_batches_without_memory_information(stub_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    monkeypatch.setattr(mermaid_converter, "get_available_memory", lambda: None)
+    codes = [f"graph TD\n  A-->N{i}" for i in range(10)]
+    input_file = tmp_path / "input.md"
+    input_file.write_text(
+        "\n\n".join(f"```mermaid\n{code}\n```" for code in codes), encoding="utf-8"
+    )
+
+    process_markdown_file(
+        str(input_file), str(tmp_path / "output.md"), image_dir=str(tmp_path / "img")
+    )
+
+    # Two CPUs with the fallback budget of four renders each: runs of four diagrams
+    assert sorted(_runs(stub_mmdc)) == ["batch 2", "batch 4", "batch 4"]
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        (b"```mermaid\ngraph TD\n  A-->B\n```\n", [b"graph TD\n  A-->B"]),
+        (b"x\r\n```mermaid\r\ngraph TD\r\n```\r\ny", [b"graph TD"]),
+        (
+            b"```mermaid\r\ngraph TD\r\n  A-->B\r\n```\r\n",
+            [b"graph TD\r\n  A-->B"],
+        ),
+        (b"```mermaid\ngraph TD\n```  \t\nafter", [b"graph TD"]),
+        (b"\xef\xbb\xbf```mermaid\ngraph TD\n```\n", [b"graph TD"]),
+        (b"Fence it with ```mermaid\ngraph TD\n```\n", []),
+        (b"```mermaid\ngraph TD\n  A-->B\n", []),
+        (b"```mermaid\ngraph TD\n```js\ncode\n```\n", []),
+    ],
+    ids=[
+        "plain",
+        "crlf",
+        "crlf-multi-line",
+        "closing-trailing-spaces",
+        "bom",
+        "inline-mention",
+        "unclosed",
+        "closing-with-info-string",
+    ],
+)
+def test_mermaid_block_pattern(markdown, expected):
+    assert _MERMAID_RE.findall(markdown) == expected
+
+
+def test_crlf_documents_share_images_with_lf_documents(stub_mmdc, tmp_path):
+    lf_document = b"# Title\n\n```mermaid\ngraph TD\n  A-->B\n```\n\nText\n"
+    crlf_document = lf_document.replace(b"\n", b"\r\n")
+    image_dir = tmp_path / "img"
+    for name, document in [("lf", lf_document), ("crlf", crlf_document)]:
+        (tmp_path / f"{name}.md").write_bytes(document)
+        process_markdown_file(
+            str(tmp_path / f"{name}.md"),
+            str(tmp_path / f"{name}_out.md"),
+            image_dir=str(image_dir),
+        )
+
+    # One image serves both documents, rendered from the '\n' source
+    filename = get_deterministic_filename(b"graph TD\n  A-->B")
+    assert os.listdir(image_dir) == [filename]
+    assert _runs(stub_mmdc) == ["single"]
+    assert (image_dir / filename).read_bytes() == b"graph TD\n  A-->B"
+    lf_output = (tmp_path / "lf_out.md").read_bytes()
+    assert lf_output == (
+        f"# Title\n\n\n![Mermaid Diagram](img/{filename})\n\n\nText\n".encode()
+    )
+    assert (tmp_path / "crlf_out.md").read_bytes() == lf_output.replace(
+        b"\n", b"\r\n"
+    )
+
+def test_in_place_run_writes_through_links_and_keeps_mode(
+    stub_mmdc, tmp_path, monkeypatch
+):
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    real_file = tmp_path / "real.md"
+    real_file.write_text("```mermaid\ngraph TD\n  A-->B\n```\n", encoding="utf-8")
+    real_file.chmod(0o600)
+    link_file = tmp_path / "link.md"
+    link_file.symlink_to(real_file)
+
+    process_markdown_file(str(link_file), str(link_file), image_dir=str(tmp_path))
+
+    assert link_file.is_symlink()
+    assert stat.S_IMODE(real_file.stat().st_mode) == 0o600
+    assert "![Mermaid Diagram]" in real_file.read_text(encoding="utf-8")
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_writes_leave_other_files_alone_and_follow_the_umask(stub_mmdc, tmp_path):
+    user_file = tmp_path / "output.md.tmp"
+    user_file.write_bytes(b"keep me")
+    (tmp_path / "diagram.md").write_bytes(b"```mermaid\ngraph TD\n```\n")
+    (tmp_path / "plain.md").write_bytes(PLAIN_DOCUMENT)
+    umask = os.umask(0o027)
+    try:
+        for name in ["diagram", "plain"]:
+            output_file = tmp_path / "output.md"
+            if output_file.exists():
+                output_file.unlink()
+            process_markdown_file(
+                str(tmp_path / f"{name}.md"), str(output_file), image_dir=str(tmp_path)
+            )
+            assert stat.S_IMODE(output_file.stat().st_mode) == 0o640
+    finally:
+        os.umask(umask)
+
+    assert (tmp_path / "output.md").read_bytes() == PLAIN_DOCUMENT
+    assert user_file.read_bytes() == b"keep me"
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_missing_mmdc_keeps_blocks_and_copies_plain_documents(
+    tmp_path, monkeypatch, caplog
+):
+    empty_bin = tmp_path / "bin"
+    empty_bin.mkdir()
+    monkeypatch.setenv("PATH", str(empty_bin))
+    _clear_caches()
+    document = b"# Title\n\n```mermaid\ngraph TD\n  A-->B\n```\n\nText\n"
+    input_file = tmp_path / "input.md"
+    input_file.write_bytes(document)
+    plain_file = tmp_path / "plain.md"
+    plain_file.write_bytes(b"# No diagrams\n")
+    image_dir = tmp_path / "img"
+
+    try:
+        process_markdown_file(
+            str(input_file), str(tmp_path / "output.md"), image_dir=str(image_dir)
+        )
+        process_markdown_file(
+            str(plain_file), str(tmp_path / "plain_out.md"), image_dir=str(image_dir)
+        )
+    finally:
+        _clear_caches()
+
+    assert (tmp_path / "output.md").read_bytes() == document
+    assert (tmp_path / "plain_out.md").read_bytes() == b"# No diagrams\n"
+    assert os.listdir(image_dir) == []
+    not_found = [r for r in caplog.records if "mmdc) not found" in r.getMessage()]
+    assert len(not_found) == 1
+
+
+def test_in_place_run_without_diagrams_leaves_file_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    document = tmp_path / "doc.md"
+    document.write_bytes(PLAIN_DOCUMENT)
+
+    process_markdown_file(str(document), str(document), image_dir=str(tmp_path))
+
+    assert document.read_bytes() == PLAIN_DOCUMENT
+
+
+def test_run_without_diagrams_onto_a_link_to_the_input_leaves_file_unchanged(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    document = tmp_path / "doc.md"
+    document.write_bytes(PLAIN_DOCUMENT)
+    link_file = tmp_path / "link.md"
+    link_file.symlink_to(document)
+
+    process_markdown_file(str(document), str(link_file), image_dir=str(tmp_path))
+
+    assert link_file.is_symlink()
+    assert document.read_bytes() == PLAIN_DOCUMENT
+